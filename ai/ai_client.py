@@ -1,19 +1,63 @@
 import asyncio
+import hashlib
+import json
 import logging
-from typing import Any, AsyncGenerator, Dict, List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 
 import numpy as np
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, RateLimitError
+
+from .cache import PersistentEmbeddingCache, TTLCache
 
 logger = logging.getLogger("eora")
 
+# Требования к цитированию, добавляемые к системному промпту при стриминге
+_CITATION_REQUIREMENTS = """
+    ВАЖНОЕ ТРЕБОВАНИЕ ПО ЦИТИРОВАНИЮ:
+    Всегда цитируй источники, используя следующий формат:
+    1. После каждого утверждения, факта или данных из источника, добавляй номер источника в квадратных скобках [N]
+    2. N должно быть номером источника из предоставленного списка (начиная с 1)
+    3. Используй только те источники, которые указаны в списке
+    4. НЕ добавляй URL в текст, используй только номера в формате [N]
+    5. Добавляй ссылку СРАЗУ после текста, к которому она относится
+    7. Нумерация источников должна соответствовать нумерации в предоставленном списке
+    """
+
+_USER_PROMPT_TEMPLATE = """
+КОНТЕКСТ ИЗ БАЗЫ ЗНАНИЙ:
+{context}
+
+ВОПРОС КЛИЕНТА: {question}
+
+Пожалуйста, дай максимально полный и полезный ответ на основе доступной информации.""".format
+
+_STREAM_USER_PROMPT_TEMPLATE = """
+    КОНТЕКСТ ИЗ БАЗЫ ЗНАНИЙ:
+    {context}
+
+    ВОПРОС КЛИЕНТА: {question}
+
+    Пожалуйста, дай максимально полный и полезный ответ на основе доступной информации.
+    """.format
+
 
 class AIClient:
     """
     Класс для работы с API языковых моделей и эмбеддингов.
     """
 
-    def __init__(self, api_key: str, api_base_url: str, embedding_model: str):
+    # Порог размера (в символах) и времени (в секундах) для выдачи буфера стриминга
+    _STREAM_FLUSH_CHARS = 64
+    _STREAM_FLUSH_INTERVAL = 0.05
+
+    def __init__(
+        self,
+        api_key: str,
+        api_base_url: str,
+        embedding_model: str,
+        embedding_cache_path: Optional[str] = None,
+        embeddings_dim: int = 1536,
+    ):
         """
         Инициализация клиента AI.
 
@@ -21,11 +65,19 @@ class AIClient:
             api_key: API ключ для доступа к сервисам
             api_base_url: Базовый URL для API запросов
             embedding_model: Модель для создания эмбеддингов
+            embedding_cache_path: Путь к дисковому кэшу эмбеддингов (None - без кэша)
+            embeddings_dim: Размерность эмбеддингов
         """
         self.api_key = api_key
         self.api_base_url = api_base_url
         self.embedding_model = embedding_model
+        self.embeddings_dim = embeddings_dim
         self.client = AsyncOpenAI(api_key=api_key, base_url=api_base_url)
+        self._embedding_cache = (
+            PersistentEmbeddingCache(embedding_cache_path)
+            if embedding_cache_path
+            else None
+        )
 
         # Системный промпт по умолчанию
         self.default_system_prompt = """Ты — экспертный консультант компании Eora, которая специализируется на разработке AI решений, чат-ботов, нейросетей и автоматизации бизнес-процессов.
@@ -50,13 +102,113 @@ class AIClient:
 - Включай практические советы и рекомендации
 """
 
+        # Системный промпт для стриминга собираем один раз
+        self._stream_system_prompt = self.default_system_prompt + _CITATION_REQUIREMENTS
+
         # Статистика для мониторинга использования API
         self.stats = {
             "embedding_calls": 0,
+            "embedding_cache_hits": 0,
+            "embedding_cache_misses": 0,
             "completion_calls": 0,
             "tokens_used": 0,
+            "completion_cache_hits": 0,
+            "completion_cache_misses": 0,
         }
 
+        # Кэш ответов LLM для одинаковых запросов
+        self._response_cache = TTLCache(maxsize=1000, ttl=3600)
+        self._cache_lock = asyncio.Lock()
+
+    @staticmethod
+    def _hash_key(
+        system_prompt: str,
+        question: str,
+        context: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+    ) -> str:
+        """
+        Формирует ключ кэша ответов по параметрам запроса к LLM.
+
+        Returns:
+            SHA-256 от канонического JSON параметров запроса
+        """
+        payload = json.dumps(
+            {
+                "system_prompt": system_prompt,
+                "question": question,
+                "context": context,
+                "model": model,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def _get_cached_response(self, key: str) -> Optional[str]:
+        """
+        Возвращает закэшированный ответ LLM и обновляет статистику.
+
+        Args:
+            key: Ключ кэша ответов
+        """
+        async with self._cache_lock:
+            cached = self._response_cache.get(key)
+
+        if cached is None:
+            self.stats["completion_cache_misses"] += 1
+        else:
+            self.stats["completion_cache_hits"] += 1
+        return cached
+
+    async def _cache_response(self, key: str, content: str) -> None:
+        """
+        Сохраняет ответ LLM в кэш.
+
+        Args:
+            key: Ключ кэша ответов
+            content: Текст ответа
+        """
+        async with self._cache_lock:
+            self._response_cache[key] = content
+
+    async def _split_cached_embeddings(
+        self, texts: List[str]
+    ) -> Tuple[np.ndarray, List[int], List[bytes]]:
+        """
+        Разделяет тексты на найденные в дисковом кэше и отсутствующие в нем.
+
+        Args:
+            texts: Список текстов
+
+        Returns:
+            Кортеж (массив эмбеддингов с заполненными попаданиями, индексы промахов,
+            ключи кэша)
+        """
+        embeddings = np.empty((len(texts), self.embeddings_dim), dtype=np.float32)
+        if self._embedding_cache is None:
+            return embeddings, list(range(len(texts))), []
+
+        keys = [
+            self._embedding_cache.make_key(self.embedding_model, text) for text in texts
+        ]
+        # Чтение из SQLite выполняем в отдельном потоке, не блокируя цикл событий
+        cached = await asyncio.to_thread(self._embedding_cache.get_many, keys)
+        missing_indices = []
+        for i, key in enumerate(keys):
+            if key in cached:
+                embeddings[i] = cached[key]
+            else:
+                missing_indices.append(i)
+
+        self.stats["embedding_cache_hits"] += len(texts) - len(missing_indices)
+        self.stats["embedding_cache_misses"] += len(missing_indices)
+        return embeddings, missing_indices, keys
+
     async def get_embedding(self, text: str) -> Optional[np.ndarray]:
         """
         Получает эмбеддинг для текста.
@@ -67,18 +219,76 @@ class AIClient:
         Returns:
             Эмбеддинг в виде numpy массива или None в случае ошибки
         """
-        try:
-            self.stats["embedding_calls"] += 1
-            response = await self.client.embeddings.create(
-                input=[text], model=self.embedding_model
-            )
-            return np.array(response.data[0].embedding, dtype=np.float32)
-        except Exception as e:
-            logger.error(f"Ошибка при получении эмбеддинга: {e}")
+        embeddings = await self.get_embeddings_multi([text])
+        return None if embeddings is None else embeddings[0]
+
+    async def get_embeddings_multi(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        Получает эмбеддинги для нескольких текстов одним запросом к API.
+
+        Args:
+            texts: Список текстов для эмбеддингов
+
+        Returns:
+            Массив эмбеддингов в порядке текстов или None в случае ошибки
+        """
+        embeddings, missing_indices, keys = await self._split_cached_embeddings(texts)
+
+        if missing_indices:
+            try:
+                self.stats["embedding_calls"] += 1
+                response = await self.client.embeddings.create(
+                    input=[texts[i] for i in missing_indices],
+                    model=self.embedding_model,
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при получении эмбеддинга: {e}")
+                return None
+
+            new_embeddings = {}
+            items = sorted(response.data, key=lambda e: e.index)
+            for i, item in zip(missing_indices, items):
+                embeddings[i] = item.embedding
+                if keys:
+                    new_embeddings[keys[i]] = embeddings[i]
+
+            if self._embedding_cache is not None:
+                await asyncio.to_thread(self._embedding_cache.put_many, new_embeddings)
+
+        return embeddings
+
+    @staticmethod
+    def _get_retry_after(error: Exception) -> Optional[float]:
+        """
+        Извлекает рекомендованную API паузу перед повтором из ответа 429.
+
+        Args:
+            error: Исключение, полученное от клиента OpenAI
+
+        Returns:
+            Пауза в секундах или None, если API ее не указал
+        """
+        if not isinstance(error, RateLimitError):
             return None
 
+        headers = error.response.headers
+        try:
+            retry_after_ms = headers.get("retry-after-ms")
+            if retry_after_ms is not None:
+                return float(retry_after_ms) / 1000
+            retry_after = headers.get("retry-after")
+            if retry_after is not None:
+                return float(retry_after)
+        except ValueError:
+            pass
+        return None
+
     async def get_batch_embeddings(
-        self, texts: List[str], batch_size: int = 32, max_retries: int = 3
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        max_retries: int = 3,
+        max_concurrency: int = 4,
     ) -> np.ndarray:
         """
         Получает эмбеддинги для списка текстов, обрабатывая их пакетами.
@@ -87,49 +297,65 @@ class AIClient:
             texts: Список текстов для эмбеддингов
             batch_size: Размер пакета для обработки
             max_retries: Максимальное количество повторных попыток при ошибке
+            max_concurrency: Максимальное количество одновременных запросов к API
 
         Returns:
             Массив эмбеддингов
         """
-        all_embeddings = []
-
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-            if not batch:
-                continue
-
-            self.stats["embedding_calls"] += 1
-
-            for attempt in range(max_retries):
-                try:
-                    response = await self.client.embeddings.create(
-                        input=batch, model=self.embedding_model
-                    )
-
-                    # Сортируем по индексу, чтобы сохранить порядок
-                    batch_embeddings = sorted(response.data, key=lambda e: e.index)
-                    all_embeddings.extend([item.embedding for item in batch_embeddings])
-
-                    # Пауза между запросами для соблюдения rate limits
-                    await asyncio.sleep(0.5)
-                    break
-                except Exception as e:
-                    wait_time = 2**attempt
-                    logger.warning(
-                        f"Ошибка при получении эмбеддингов: {e}. "
-                        f"Попытка {attempt + 1}/{max_retries}. "
-                        f"Повтор через {wait_time} сек."
-                    )
-                    if attempt + 1 == max_retries:
-                        logger.error(
-                            f"Не удалось обработать пакет после {max_retries} попыток."
+        # Берем из кэша всё, что уже было получено ранее
+        all_embeddings, missing_indices, keys = await self._split_cached_embeddings(
+            texts
+        )
+        new_embeddings = {}
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch_batch(batch_indices: List[int]) -> None:
+            batch = [texts[j] for j in batch_indices]
+
+            async with semaphore:
+                self.stats["embedding_calls"] += 1
+
+                for attempt in range(max_retries):
+                    try:
+                        response = await self.client.embeddings.create(
+                            input=batch, model=self.embedding_model
                         )
-                        # Возвращаем нулевые эмбеддинги как fallback
-                        all_embeddings.extend([[0.0] * 1536] * len(batch))
-                    else:
-                        await asyncio.sleep(wait_time)
 
-        return np.array(all_embeddings, dtype=np.float32)
+                        # Сортируем по индексу, чтобы сохранить порядок
+                        batch_embeddings = sorted(response.data, key=lambda e: e.index)
+                        for j, item in zip(batch_indices, batch_embeddings):
+                            all_embeddings[j] = item.embedding
+                            if keys:
+                                new_embeddings[keys[j]] = all_embeddings[j]
+                        return
+                    except Exception as e:
+                        # При превышении rate limit ждем столько, сколько просит API
+                        wait_time = self._get_retry_after(e) or 2**attempt
+                        logger.warning(
+                            f"Ошибка при получении эмбеддингов: {e}. "
+                            f"Попытка {attempt + 1}/{max_retries}. "
+                            f"Повтор через {wait_time} сек."
+                        )
+                        if attempt + 1 == max_retries:
+                            logger.error(
+                                f"Не удалось обработать пакет после {max_retries} попыток."
+                            )
+                            # Возвращаем нулевые эмбеддинги как fallback
+                            all_embeddings[batch_indices] = 0.0
+                        else:
+                            await asyncio.sleep(wait_time)
+
+        await asyncio.gather(
+            *(
+                fetch_batch(missing_indices[i : i + batch_size])
+                for i in range(0, len(missing_indices), batch_size)
+            )
+        )
+
+        if self._embedding_cache is not None:
+            await asyncio.to_thread(self._embedding_cache.put_many, new_embeddings)
+
+        return all_embeddings
 
     async def get_completion(
         self,
@@ -157,13 +383,14 @@ class AIClient:
         if system_prompt is None:
             system_prompt = self.default_system_prompt
 
-        user_prompt = f"""
-КОНТЕКСТ ИЗ БАЗЫ ЗНАНИЙ:
-{context}
-
-ВОПРОС КЛИЕНТА: {question}
+        user_prompt = _USER_PROMPT_TEMPLATE(context=context, question=question)
 
-Пожалуйста, дай максимально полный и полезный ответ на основе доступной информации."""
+        cache_key = self._hash_key(
+            system_prompt, question, context, model, temperature, max_tokens
+        )
+        cached = await self._get_cached_response(cache_key)
+        if cached is not None:
+            return cached
 
         try:
             logger.info("Отправка запроса к LLM...")
@@ -179,7 +406,10 @@ class AIClient:
                 max_tokens=max_tokens,
             )
 
-            return response.choices[0].message.content
+            content = response.choices[0].message.content
+            if content is not None:
+                await self._cache_response(cache_key, content)
+            return content
         except Exception as e:
             error_message = f"Ошибка при запросе к LLM: {e}"
             logger.error(error_message)
@@ -192,6 +422,7 @@ class AIClient:
         model: str = "gpt-4o",
         temperature: float = 0.2,
         max_tokens: int = 5000,
+        instructions: Optional[str] = None,
     ) -> AsyncGenerator[str, None]:
         """
         Стримит ответ от языковой модели по мере генерации.
@@ -202,29 +433,22 @@ class AIClient:
             model: Модель для генерации
             temperature: Температура генерации
             max_tokens: Максимальное количество токенов в ответе
+            instructions: Неизменные дополнительные инструкции для системного промпта
         """
-        system_prompt = (
-            self.default_system_prompt
-            + """
-    ВАЖНОЕ ТРЕБОВАНИЕ ПО ЦИТИРОВАНИЮ:
-    Всегда цитируй источники, используя следующий формат:
-    1. После каждого утверждения, факта или данных из источника, добавляй номер источника в квадратных скобках [N]
-    2. N должно быть номером источника из предоставленного списка (начиная с 1)
-    3. Используй только те источники, которые указаны в списке
-    4. НЕ добавляй URL в текст, используй только номера в формате [N]
-    5. Добавляй ссылку СРАЗУ после текста, к которому она относится
-    7. Нумерация источников должна соответствовать нумерации в предоставленном списке
-    """
+        # Постоянный текст идет в начале запроса, чтобы провайдер мог переиспользовать
+        # закэшированный префикс промпта между запросами
+        system_prompt = self._stream_system_prompt
+        if instructions:
+            system_prompt += instructions
+        user_prompt = _STREAM_USER_PROMPT_TEMPLATE(context=context, question=question)
+
+        cache_key = self._hash_key(
+            system_prompt, question, context, model, temperature, max_tokens
         )
-
-        user_prompt = f"""
-    КОНТЕКСТ ИЗ БАЗЫ ЗНАНИЙ:
-    {context}
-
-    ВОПРОС КЛИЕНТА: {question}
-
-    Пожалуйста, дай максимально полный и полезный ответ на основе доступной информации.
-    """
+        cached = await self._get_cached_response(cache_key)
+        if cached is not None:
+            yield cached
+            return
 
         try:
             logger.info("Отправка запроса к LLM со стримингом...")
@@ -241,15 +465,42 @@ class AIClient:
                 stream=True,
             )
 
+            # Склеиваем мелкие фрагменты, чтобы не передавать дальше каждый токен
+            loop = asyncio.get_running_loop()
+            last_flush = loop.time()
+            response_parts = []
+            buffer = []
+            buffered_length = 0
+
             async for chunk in stream:
                 content = chunk.choices[0].delta.content
-                if content is not None:
-                    yield content
+                if content is None:
+                    continue
+
+                response_parts.append(content)
+                buffer.append(content)
+                buffered_length += len(content)
+
+                now = loop.time()
+                if (
+                    buffered_length >= self._STREAM_FLUSH_CHARS
+                    or now - last_flush > self._STREAM_FLUSH_INTERVAL
+                ):
+                    yield "".join(buffer)
+                    buffer.clear()
+                    buffered_length = 0
+                    last_flush = now
+
+            if buffer:
+                yield "".join(buffer)
+
+            # Кэшируем только полностью полученный ответ
+            await self._cache_response(cache_key, "".join(response_parts))
 
         except Exception as e:
-            error_message = f"Ошибка при запросе к LLM: {e}"
-            logger.error(error_message)
-            yield error_message
+            # Ошибку пробрасываем, чтобы вызывающий код не принял ее текст за ответ
+            logger.error(f"Ошибка при запросе к LLM: {e}")
+            raise
 
     def get_stats(self) -> Dict[str, Any]:
         """
@@ -0,0 +1,257 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class TTLCache:
+    """LRU-кэш с ограничением времени жизни записей."""
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600):
+        """
+        Args:
+            maxsize: Максимальное количество записей в кэше
+            ttl: Время жизни записи в секундах
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """
+        Возвращает значение по ключу, если запись существует и не устарела.
+
+        Args:
+            key: Ключ записи
+            default: Значение, возвращаемое при промахе
+        """
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        # Помечаем запись как недавно использованную
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+
+        # Вытесняем самые давно использованные записи
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SemanticCache:
+    """Кэш значений по косинусной близости эмбеддингов запросов."""
+
+    def __init__(
+        self, threshold: float = 0.95, maxsize: int = 2048, ttl: Optional[float] = None
+    ):
+        """
+        Args:
+            threshold: Минимальная косинусная близость для попадания в кэш
+            maxsize: Максимальное количество записей в кэше
+            ttl: Время жизни записи в секундах (None - без ограничения)
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._vectors: Optional[np.ndarray] = None
+        self._last_used = np.zeros(0, dtype=np.int64)
+        self._expires_at = np.zeros(0, dtype=np.float64)
+        self._values: List[Any] = []
+        self._size = 0
+        self._tick = 0
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, vector: np.ndarray) -> Optional[Any]:
+        """
+        Ищет значение для ближайшего закэшированного запроса.
+
+        Args:
+            vector: Эмбеддинг запроса
+
+        Returns:
+            Закэшированное значение или None, если близкого запроса нет
+        """
+        if self._size == 0:
+            return None
+
+        similarities = self._vectors[: self._size] @ self._normalize(vector)
+        if self.ttl is not None:
+            # Устаревшие записи не участвуют в поиске и вытесняются первыми
+            expired = self._expires_at[: self._size] < time.monotonic()
+            similarities[expired] = -np.inf
+            self._last_used[: self._size][expired] = 0
+
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        self._tick += 1
+        self._last_used[best] = self._tick
+        return self._values[best]
+
+    def put(self, vector: np.ndarray, value: Any) -> None:
+        """
+        Сохраняет значение для запроса, вытесняя давно неиспользуемые записи.
+
+        Args:
+            vector: Эмбеддинг запроса
+            value: Сохраняемое значение
+        """
+        vector = self._normalize(vector)
+        if self._vectors is None:
+            capacity = min(64, self.maxsize)
+            self._vectors = np.empty((capacity, vector.shape[0]), dtype=np.float32)
+            self._last_used = np.zeros(capacity, dtype=np.int64)
+            self._expires_at = np.zeros(capacity, dtype=np.float64)
+
+        if self._size < self.maxsize:
+            # Расширяем буфер с запасом, чтобы не копировать его на каждой вставке
+            if self._size == self._vectors.shape[0]:
+                capacity = min(self._size * 2, self.maxsize)
+                self._vectors = np.resize(self._vectors, (capacity, vector.shape[0]))
+                self._last_used = np.resize(self._last_used, capacity)
+                self._expires_at = np.resize(self._expires_at, capacity)
+            row = self._size
+            self._size += 1
+            self._values.append(value)
+        else:
+            row = int(np.argmin(self._last_used))
+            self._values[row] = value
+
+        self._tick += 1
+        self._vectors[row] = vector
+        self._last_used[row] = self._tick
+        if self.ttl is not None:
+            self._expires_at[row] = time.monotonic() + self.ttl
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class PersistentEmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов, адресуемый по содержимому текста.
+
+    Методы выполняют блокирующий ввод-вывод, поэтому из асинхронного кода их
+    вызывают через asyncio.to_thread.
+    """
+
+    # Ограничение SQLite на количество параметров в одном запросе
+    _QUERY_CHUNK_SIZE = 500
+
+    def __init__(self, path: str, max_rows: int = 100_000):
+        """
+        Args:
+            path: Путь к файлу базы данных кэша
+            max_rows: Максимальное количество записей, сверх него вытесняются
+                самые старые
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_rows = max_rows
+
+        # Соединение используется из разных рабочих потоков, поэтому обращения
+        # к нему сериализуются блокировкой
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL это сохраняет целостность базы без fsync на каждый коммит
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL) "
+            "WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_created_at "
+            "ON embeddings (created_at)"
+        )
+
+    @staticmethod
+    def make_key(model: str, text: str) -> bytes:
+        """
+        Формирует ключ кэша для текста и модели эмбеддингов.
+
+        Args:
+            model: Модель эмбеддингов
+            text: Исходный текст
+        """
+        return hashlib.sha256(f"{model}\0{text}".encode()).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Возвращает найденные в кэше эмбеддинги.
+
+        Args:
+            keys: Ключи кэша
+
+        Returns:
+            Словарь {ключ: эмбеддинг} только для найденных ключей
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+
+        with self._lock:
+            for i in range(0, len(unique_keys), self._QUERY_CHUNK_SIZE):
+                chunk = unique_keys[i : i + self._QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+
+        return found
+
+    def put_many(self, items: Dict[bytes, np.ndarray]) -> None:
+        """
+        Сохраняет эмбеддинги в кэш одной транзакцией и вытесняет самые старые
+        записи сверх лимита.
+
+        Args:
+            items: Словарь {ключ: эмбеддинг}
+        """
+        if not items:
+            return
+
+        created_at = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) "
+                "VALUES (?, ?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes(), created_at)
+                    for key, vector in items.items()
+                ],
+            )
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY created_at "
+                "LIMIT max((SELECT COUNT(*) FROM embeddings) - ?, 0))",
+                (self.max_rows,),
+            )
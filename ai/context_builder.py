@@ -1,8 +1,21 @@
 import logging
+from functools import lru_cache
 from typing import Dict, List
 
+import numpy as np
+
 logger = logging.getLogger("eora")
 
+_FRAGMENT_TEMPLATE = (
+    "Источник: {source}\nРелевантность: {similarity:.2f}\nКонтент: {text}\n"
+).format
+
+
+@lru_cache(maxsize=1024)
+def _project_name(source: str) -> str:
+    """Извлекает название проекта из URL."""
+    return source.rsplit("/", 1)[-1].replace("-", " ").title()
+
 
 class ContextBuilder:
     """Класс для создания контекста из результатов поиска."""
@@ -25,32 +38,39 @@ class ContextBuilder:
         if not search_results:
             return ""
 
-        # Группируем результаты по источникам для лучшей организации
-        by_source = {}
-        for result in search_results:
-            source = result["source"]
-            if source not in by_source:
-                by_source[source] = []
-            by_source[source].append(result)
-
-        context_parts = []
-
-        # Добавляем результаты, организованные по источникам
-        for source, results in by_source.items():
-            # Берем лучшие результаты из каждого источника
-            best_results = sorted(results, key=lambda x: x["similarity"], reverse=True)[
-                :10
-            ]
+        sims = np.fromiter(
+            (r["similarity"] for r in search_results),
+            dtype=np.float64,
+            count=len(search_results),
+        )
+        sources = np.array([r["source"] for r in search_results])
 
-            for result in best_results:
-                if result["similarity"] > 0.2:  # Фильтруем слишком слабые совпадения
-                    context_parts.append(
-                        f"Источник: {result['source']}\n"
-                        f"Релевантность: {result['similarity']:.2f}\n"
-                        f"Контент: {result['text']}\n"
-                    )
+        # Группируем результаты по источникам в порядке их первого появления
+        _, first_index, inverse = np.unique(
+            sources, return_index=True, return_inverse=True
+        )
+        group_position = first_index[inverse]
+        order = np.lexsort((-sims, group_position))
 
-        return "\n---\n".join(context_parts[: self.max_context_length])
+        # Ранг результата внутри своего источника (0 - самый релевантный)
+        grouped = group_position[order]
+        group_starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(order)])
+        rank = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+
+        # Берем лучшие результаты из каждого источника и фильтруем слишком слабые
+        selected = order[(rank < 10) & (sims[order] > 0.2)][: self.max_context_length]
+
+        return "\n---\n".join(
+            [
+                _FRAGMENT_TEMPLATE(
+                    source=search_results[i]["source"],
+                    similarity=search_results[i]["similarity"],
+                    text=search_results[i]["text"],
+                )
+                for i in selected
+            ]
+        )
 
     def extract_sources(
         self, search_results: List[Dict], limit: int = 36
@@ -62,15 +82,13 @@ class ContextBuilder:
             search_results: Результаты поиска
             limit: Максимальное количество источников
         """
-        all_sources = set()
+        # Источники в порядке первого появления, т.е. по убыванию релевантности
+        sources = {}
         for res in search_results:
-            all_sources.add(res["source"])
-        sources = sorted(list(all_sources))[:limit]
-        formatted_sources = []
-
-        for source in sources:
-            # Извлекаем название проекта из URL
-            project_name = source.split("/")[-1].replace("-", " ").title()
-            formatted_sources.append({"name": project_name, "url": source})
+            source = res["source"]
+            if source not in sources:
+                if len(sources) >= limit:
+                    break
+                sources[source] = None
 
-        return formatted_sources
+        return [{"name": _project_name(source), "url": source} for source in sources]
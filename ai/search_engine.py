@@ -1,22 +1,51 @@
 import asyncio
 import logging
 import re
+from parser import ChunkStore
 from typing import Dict, List, Set
 
 import hnswlib
+import numpy as np
+
+from .cache import SemanticCache
 
 logger = logging.getLogger("eora")
 
+_KW_RE = re.compile(r"\b[а-яёА-ЯЁa-zA-Z]{3,}\b")
+
+# Слова, не несущие смысловой нагрузки
+_STOP_WORDS = frozenset(
+    {
+        "как",
+        "что",
+        "где",
+        "когда",
+        "почему",
+        "который",
+        "которая",
+        "которое",
+        "для",
+        "или",
+        "это",
+        "есть",
+        "был",
+        "была",
+        "было",
+        "были",
+        "может",
+    }
+)
+
 
 class SearchEngine:
     """Класс для поиска информации в векторной базе данных."""
 
-    def __init__(self, ai_client, index: hnswlib.Index, metadata: List[Dict]):
+    def __init__(self, ai_client, index: hnswlib.Index, metadata: ChunkStore):
         """
         Args:
             ai_client: Экземпляр класса AIClient для получения эмбеддингов
             index: Индекс HNSW для поиска ближайших соседей
-            metadata: Метаданные документов
+            metadata: Хранилище чанков документов
         """
         self.ai_client = ai_client
         self.index = index
@@ -26,6 +55,41 @@ class SearchEngine:
             "direct_hits": 0,
             "expanded_hits": 0,
             "keyword_hits": 0,
+            "semantic_cache_hits": 0,
+        }
+
+        # Кэш результатов поиска для близких по смыслу вопросов
+        self._query_cache = SemanticCache(threshold=0.95, maxsize=2048)
+
+        # Инвертированный индекс для поиска по ключевым словам
+        self._postings = self._build_keyword_index()
+
+        # Номер первого чанка с таким же текстом - для дедупликации результатов
+        self._text_ids = self._build_text_ids()
+
+    def _build_text_ids(self) -> List[int]:
+        """
+        Сопоставляет каждому чанку номер первого чанка с идентичным текстом.
+        """
+        first_ids: Dict[str, int] = {}
+        return [
+            first_ids.setdefault(self.metadata.get_text(i), i)
+            for i in range(len(self.metadata))
+        ]
+
+    def _build_keyword_index(self) -> Dict[str, np.ndarray]:
+        """
+        Строит инвертированный индекс: слово -> номера чанков, в которых оно встречается.
+        """
+        postings: Dict[str, List[int]] = {}
+        for i in range(len(self.metadata)):
+            words = set(_KW_RE.findall(self.metadata.get_text(i).lower()))
+            for word in words:
+                postings.setdefault(word, []).append(i)
+
+        return {
+            word: np.fromiter(ids, dtype=np.uint32, count=len(ids))
+            for word, ids in postings.items()
         }
 
     def expand_query(self, question: str) -> List[str]:
@@ -46,11 +110,12 @@ class SearchEngine:
         }
 
         expanded_queries = [question]
+        lower_question = question.lower()
 
         for word, syns in synonyms.items():
-            if word in question.lower():
+            if word in lower_question:
                 for syn in syns:
-                    expanded_queries.append(question.lower().replace(word, syn))
+                    expanded_queries.append(lower_question.replace(word, syn))
 
         return expanded_queries
 
@@ -61,29 +126,7 @@ class SearchEngine:
         Args:
             text: Исходный текст
         """
-        words = re.findall(r"\b[а-яёА-ЯЁa-zA-Z]{3,}\b", text.lower())
-        # Убираем слова, не несущие смысловой нагрузки
-        stop_words = {
-            "как",
-            "что",
-            "где",
-            "когда",
-            "почему",
-            "который",
-            "которая",
-            "которое",
-            "для",
-            "или",
-            "это",
-            "есть",
-            "был",
-            "была",
-            "было",
-            "были",
-            "может",
-        }
-        keywords = [word for word in words if word not in stop_words]
-        return list(set(keywords))
+        return list({w for w in _KW_RE.findall(text.lower()) if w not in _STOP_WORDS})
 
     def keyword_search(self, keywords: List[str], threshold: int = 1) -> List[Dict]:
         """
@@ -93,23 +136,25 @@ class SearchEngine:
             keywords: Список ключевых слов
             threshold: Минимальное количество совпадений для включения в результаты
         """
-        results = []
-
-        for i, chunk in enumerate(self.metadata):
-            text_lower = chunk["text"].lower()
-            matches = sum(1 for keyword in keywords if keyword in text_lower)
-
-            if matches >= threshold:
-                results.append(
-                    {
-                        "text": chunk["text"],
-                        "source": chunk["source"],
-                        "similarity": matches / len(keywords),
-                        "strategy": "keyword",
-                    }
-                )
+        postings = [self._postings[k] for k in keywords if k in self._postings]
+        if not postings:
+            return []
+
+        # Количество совпавших ключевых слов для каждого чанка
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.metadata))
+        candidates = np.flatnonzero(counts >= threshold)
+        top = candidates[np.argsort(-counts[candidates], kind="stable")[:5]]
 
-        return sorted(results, key=lambda x: x["similarity"], reverse=True)[:5]
+        return [
+            {
+                "id": int(i),
+                "text": self.metadata.get_text(i),
+                "source": self.metadata.get_source(i),
+                "similarity": counts[i] / len(keywords),
+                "strategy": "keyword",
+            }
+            for i in top
+        ]
 
     async def search(self, question: str, top_k: int = 10) -> List[Dict]:
         """
@@ -121,76 +166,110 @@ class SearchEngine:
         """
         self.stats["total_searches"] += 1
         all_results = []
-        seen_texts: Set[str] = set()
+        seen_ids: Set[int] = set()
 
-        # Стратегия 1: Прямой поиск по исходному вопросу
+        # Поиск по ключевым словам не зависит от эмбеддингов, поэтому запускаем его
+        # в отдельном потоке параллельно с запросом к API и поиском в индексе
+        keywords = self.extract_keywords(question)
+        keyword_task = None
+        if keywords:
+            keyword_task = asyncio.create_task(
+                asyncio.to_thread(self.keyword_search, keywords)
+            )
+
+        # Сначала получаем эмбеддинг только самого вопроса: при попадании в кэш
+        # результатов эмбеддинги расширений не нужны
         query_vector = await self.ai_client.get_embedding(question)
+
+        # Стратегия 1: Прямой поиск по исходному вопросу
         if query_vector is not None:
+            cached = self._query_cache.lookup(query_vector)
+            if cached is not None:
+                cached_top_k, cached_results = cached
+                if cached_top_k >= top_k:
+                    self.stats["semantic_cache_hits"] += 1
+                    if keyword_task is not None:
+                        keyword_task.cancel()
+                    return cached_results[:top_k]
+
+            # При промахе эмбеддинги расширений получаем одним запросом к API
+            expanded_queries = self.expand_query(question)
+            expansions = [
+                query
+                for query in dict.fromkeys(expanded_queries[1:3])
+                if query != question
+            ]
+            query_vectors = query_vector[np.newaxis]
+            if expansions:
+                expansion_vectors = await self.ai_client.get_embeddings_multi(
+                    expansions
+                )
+                if expansion_vectors is not None:
+                    query_vectors = np.vstack([query_vectors, expansion_vectors])
+
+            # Индекс хранит нормализованные векторы в пространстве "ip"
+            norms = np.linalg.norm(query_vectors, axis=1, keepdims=True)
+            query_vectors = query_vectors / np.maximum(norms, 1e-12)
+
+            # Все запросы обрабатываются одним вызовом hnswlib
             labels, distances = await asyncio.to_thread(
-                self.index.knn_query, query_vector, k=top_k
+                self.index.knn_query,
+                query_vectors,
+                k=min(top_k, self.index.get_current_count()),
+                num_threads=-1,
             )
 
             for label, dist in zip(labels[0], distances[0]):
-                text = self.metadata[label]["text"]
-                if text not in seen_texts:
+                text_id = self._text_ids[label]
+                if text_id not in seen_ids:
                     all_results.append(
                         {
-                            "text": text,
-                            "source": self.metadata[label]["source"],
+                            "id": int(label),
+                            "text": self.metadata.get_text(label),
+                            "source": self.metadata.get_source(label),
                             "similarity": 1 - dist,
                             "strategy": "direct",
                         }
                     )
-                    seen_texts.add(text)
+                    seen_ids.add(text_id)
                     self.stats["direct_hits"] += 1
 
-        # Стратегия 2: Поиск по расширенным запросам
-        expanded_queries = self.expand_query(question)
-        expanded_embedding_tasks = []
-
-        for expanded_query in expanded_queries[1:3]:  # Берем только первые 2 расширения
-            if expanded_query != question:
-                expanded_embedding_tasks.append(
-                    self.ai_client.get_embedding(expanded_query)
-                )
-
-        if expanded_embedding_tasks:  # Проверка на пустой список
-            expanded_embeddings = await asyncio.gather(*expanded_embedding_tasks)
-
-            for i, exp_vector in enumerate(expanded_embeddings):
-                if exp_vector is not None:
-                    labels, distances = await asyncio.to_thread(
-                        self.index.knn_query, exp_vector, k=5
-                    )
-
-                    for label, dist in zip(labels[0], distances[0]):
-                        text = self.metadata[label]["text"]
-                        if text not in seen_texts and (1 - dist) > 0.6:
-                            all_results.append(
-                                {
-                                    "text": text,
-                                    "source": self.metadata[label]["source"],
-                                    "similarity": 1 - dist,
-                                    "strategy": "expanded",
-                                }
-                            )
-                            seen_texts.add(text)
-                            self.stats["expanded_hits"] += 1
+            # Стратегия 2: Поиск по расширенным запросам
+            for row_labels, row_distances in zip(labels[1:], distances[1:]):
+                for label, dist in zip(row_labels, row_distances):
+                    text_id = self._text_ids[label]
+                    if text_id not in seen_ids and (1 - dist) > 0.6:
+                        all_results.append(
+                            {
+                                "id": int(label),
+                                "text": self.metadata.get_text(label),
+                                "source": self.metadata.get_source(label),
+                                "similarity": 1 - dist,
+                                "strategy": "expanded",
+                            }
+                        )
+                        seen_ids.add(text_id)
+                        self.stats["expanded_hits"] += 1
 
         # Стратегия 3: Keyword-based поиск для fallback
-        keywords = self.extract_keywords(question)
-        if keywords:
-            keyword_results = await asyncio.to_thread(self.keyword_search, keywords)
+        if keyword_task is not None:
+            keyword_results = await keyword_task
 
             for result in keyword_results:
-                if result["text"] not in seen_texts:
+                text_id = self._text_ids[result["id"]]
+                if text_id not in seen_ids:
                     all_results.append(result)
-                    seen_texts.add(result["text"])
+                    seen_ids.add(text_id)
                     self.stats["keyword_hits"] += 1
 
         # Сортируем по схожести и берем топ результаты
         all_results.sort(key=lambda x: x["similarity"], reverse=True)
-        return all_results[:top_k]
+        results = all_results[:top_k]
+
+        if query_vector is not None:
+            self._query_cache.put(query_vector, (top_k, results))
+
+        return results
 
     def get_stats(self) -> Dict:
         return self.stats
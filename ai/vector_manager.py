@@ -1,8 +1,7 @@
-import json
 import logging
 import os
-from parser import Parser, ParserConfig
-from typing import Dict, List, Optional, Tuple
+from parser import ChunkStore, Parser, ParserConfig, VectorDBBuilder
+from typing import Optional, Tuple
 
 import hnswlib
 
@@ -38,7 +37,7 @@ class VectorDatabaseManager:
 
     async def create_or_load_database(
         self, parser_config: ParserConfig
-    ) -> Tuple[Optional[hnswlib.Index], List[Dict[str, str]]]:
+    ) -> Tuple[Optional[hnswlib.Index], Optional[ChunkStore]]:
         """
         Создает или загружает векторную базу данных.
 
@@ -51,14 +50,18 @@ class VectorDatabaseManager:
         # Проверяем, существуют ли уже файлы индекса и метаданных
         if os.path.exists(self.hnsw_index_path) and os.path.exists(self.metadata_path):
             logger.info("Найдены существующие файлы индекса и метаданных. Загружаем...")
-            return self.load_database()
+            index, metadata = self.load_database()
+            if index is not None:
+                return index, metadata
+            logger.info("Не удалось загрузить индекс. Создаем новую базу данных...")
         else:
             logger.info("Файлы индекса не найдены. Создаем новую базу данных...")
-            return await self.create_database(parser_config)
+
+        return await self.create_database(parser_config)
 
     async def create_database(
         self, parser_config: ParserConfig
-    ) -> Tuple[Optional[hnswlib.Index], List[Dict[str, str]]]:
+    ) -> Tuple[Optional[hnswlib.Index], Optional[ChunkStore]]:
         """
         Создает новую векторную базу данных.
 
@@ -69,7 +72,10 @@ class VectorDatabaseManager:
             Кортеж (индекс HNSW, метаданные)
         """
         parser = Parser(parser_config)
-        stats = await parser.run()
+        try:
+            stats = await parser.run()
+        finally:
+            await parser.shutdown()
 
         logger.info(
             f"Парсинг и создание базы завершены за {stats['total_time']:.2f} секунд"
@@ -81,7 +87,7 @@ class VectorDatabaseManager:
 
         return parser.load_vector_db()
 
-    def load_database(self) -> Tuple[Optional[hnswlib.Index], List[Dict[str, str]]]:
+    def load_database(self) -> Tuple[Optional[hnswlib.Index], Optional[ChunkStore]]:
         """
         Загружает существующую векторную базу данных.
 
@@ -89,16 +95,10 @@ class VectorDatabaseManager:
             Кортеж (индекс HNSW, метаданные)
         """
         try:
-            with open(self.metadata_path, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-
-            index = hnswlib.Index(space="cosine", dim=self.embeddings_dim)
-            index.load_index(self.hnsw_index_path, max_elements=len(metadata))
-
-            logger.info(
-                f"База данных успешно загружена. Количество документов: {len(metadata)}"
+            builder = VectorDBBuilder(
+                self.hnsw_index_path, self.metadata_path, self.embeddings_dim
             )
-            return index, metadata
+            return builder.load_index()
         except Exception as e:
             logger.error(f"Ошибка при загрузке базы данных: {e}")
-            return None, []
+            return None, None
@@ -50,9 +50,9 @@ HNSW_INDEX_PATH = os.getenv(
 )
 METADATA_PATH = os.getenv("METADATA_PATH", os.path.join(INDEX_DIR, "metadata.json"))
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
-EMBEDDINGS_DIM = os.getenv("EMBEDDINGS_DIM", 1536)
+EMBEDDINGS_DIM = int(os.getenv("EMBEDDINGS_DIM", 1536))
 EMBEDDING_CACHE_PATH = os.getenv(
-    "EMBEDDING_CACHE_PATH", os.path.join(INDEX_DIR, "embedding_cache.json")
+    "EMBEDDING_CACHE_PATH", os.path.join(INDEX_DIR, "embedding_cache.sqlite")
 )
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 API_BASE_URL = os.getenv("API_BASE_URL", "https://api.openai.com/v1/")
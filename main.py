@@ -1,5 +1,7 @@
 import asyncio
+import contextlib
 import os
+import signal
 from parser import ParserConfig
 
 from ai import AIClient, ContextBuilder, SearchEngine, VectorDatabaseManager
@@ -8,6 +10,13 @@ from logger import logger
 from telegram_bot import TelegramBot
 from config import *
 
+try:
+    # Более быстрый цикл событий на libuv. На Windows uvloop не работает и не
+    # устанавливается, там остается стандартный цикл событий
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Получаем токен из переменной окружения или запрашиваем у пользователя
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
@@ -23,6 +32,8 @@ async def main():
             api_key=OPENAI_API_KEY,
             api_base_url=API_BASE_URL,
             embedding_model=EMBEDDING_MODEL,
+            embedding_cache_path=EMBEDDING_CACHE_PATH,
+            embeddings_dim=EMBEDDINGS_DIM,
         )
 
         db_manager = VectorDatabaseManager(
@@ -65,11 +76,17 @@ async def main():
         # Запускаем бота
         await bot.setup()
 
-        # Ждем прерывания
+        # Ждем сигнала остановки
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            # На Windows обработчики сигналов в цикле событий не поддерживаются
+            with contextlib.suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop_event.set)
+
         try:
-            while True:
-                await asyncio.sleep(3600)
-        except (KeyboardInterrupt, SystemExit):
+            await stop_event.wait()
+        finally:
             await bot.shutdown()
 
     except Exception as e:
@@ -79,6 +96,6 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(main(), loop_factory=uvloop.new_event_loop if uvloop else None)
     except (KeyboardInterrupt, SystemExit):
         logger.info("Бот остановлен пользователем.")
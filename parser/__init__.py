@@ -1,3 +1,4 @@
 from .parser import Parser, ParserConfig
+from .vector_builder import ChunkStore, VectorDBBuilder
 
-__all__ = ["Parser", "ParserConfig"]
+__all__ = ["ChunkStore", "Parser", "ParserConfig", "VectorDBBuilder"]
@@ -1,16 +1,38 @@
 import asyncio
-import gzip
+import contextlib
 import hashlib
 import json
 import os
 import time
-from typing import Dict, List
+from typing import List, Optional, Tuple
 
 import httpx
 import numpy as np
 from tqdm import tqdm
 
 from logger import logger
+from .http_client import create_http_client
+
+_CACHE_VERSION = "3.0"
+_CACHE_DTYPE = np.float16
+# Таймаут запроса эмбеддингов, в том числе через общий клиент парсера
+_REQUEST_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+
+def _sha256_many(texts: List[str]) -> np.ndarray:
+    """
+    Считает SHA-256 для пакета текстов.
+
+    Args:
+        texts: Список текстов
+
+    Returns:
+        Массив 32-байтных дайджестов (dtype S32) в порядке текстов
+    """
+    # Локальная ссылка избавляет от поиска атрибута модуля на каждой итерации
+    sha256 = hashlib.sha256
+    digests = b"".join([sha256(text.encode()).digest() for text in texts])
+    return np.frombuffer(digests, dtype="S32")
 
 
 class EmbeddingManager:
@@ -38,7 +60,12 @@ class EmbeddingManager:
         self.api_key = api_key
         self.model = model
         self.embeddings_dim = embeddings_dim
-        self.cache_path = os.path.join(cache_dir, "embedding_cache.json.gz")
+        # Кэш хранится в виде дописываемых бинарных файлов: 32-байтные ключи и
+        # строки float16 одинакового порядка, плюс JSON с параметрами модели.
+        # Половинной точности достаточно для косинусной близости, а файл вдвое меньше
+        self.cache_keys_path = os.path.join(cache_dir, "embedding_cache.keys")
+        self.cache_vectors_path = os.path.join(cache_dir, "embedding_cache.f16")
+        self.cache_meta_path = os.path.join(cache_dir, "embedding_cache.meta.json")
 
         # Статистика для мониторинга
         self.stats = {
@@ -48,55 +75,116 @@ class EmbeddingManager:
             "total_tokens": 0,
         }
 
-    def _load_cache(self) -> Dict[str, List[float]]:
+    def _reset_cache(self) -> None:
+        """Удаляет файлы кэша эмбеддингов."""
+        for path in (
+            self.cache_keys_path,
+            self.cache_vectors_path,
+            self.cache_meta_path,
+        ):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_cache(self) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Загружает кэш эмбеддингов из файла.
+        Загружает кэш эмбеддингов из файлов.
 
         Returns:
-            Словарь с кэшированными эмбеддингами
+            Кортеж (дайджесты текстов, матрица эмбеддингов в том же порядке)
         """
-        try:
-            with gzip.open(self.cache_path, "rt") as f:
-                cache_data = json.load(f)
-                cache = cache_data.get("embeddings", {})
-                cache_model = cache_data.get("model", self.model)
-
-                # Если модель изменилась, очищаем кэш
-                if cache_model != self.model:
-                    logger.warning(
-                        f"Модель эмбеддингов изменилась ({cache_model} -> {self.model}). Кэш будет сброшен."
-                    )
-                    return {}
+        empty_cache = (
+            np.zeros(0, dtype="S32"),
+            np.zeros((0, self.embeddings_dim), dtype=_CACHE_DTYPE),
+        )
 
-                return cache
-        except (FileNotFoundError, json.JSONDecodeError, gzip.BadGzipFile):
-            return {}
+        try:
+            with open(self.cache_meta_path, "r", encoding="utf-8") as f:
+                cache_meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return empty_cache
+
+        # Если формат, модель или размерность изменились, очищаем кэш
+        if (
+            cache_meta.get("version") != _CACHE_VERSION
+            or cache_meta.get("model") != self.model
+            or cache_meta.get("dim") != self.embeddings_dim
+        ):
+            logger.warning(
+                f"Формат кэша или модель эмбеддингов изменились ({cache_meta.get('model')} -> {self.model}). Кэш будет сброшен."
+            )
+            self._reset_cache()
+            return empty_cache
+
+        row_size = self.embeddings_dim * np.dtype(_CACHE_DTYPE).itemsize
+        key_rows = vector_rows = 0
+        if os.path.exists(self.cache_keys_path):
+            key_rows = os.path.getsize(self.cache_keys_path) // 32
+        if os.path.exists(self.cache_vectors_path):
+            vector_rows = os.path.getsize(self.cache_vectors_path) // row_size
+
+        # Отбрасываем недописанный хвост, если запись была прервана
+        rows = min(key_rows, vector_rows)
+        if rows == 0:
+            self._reset_cache()
+            return empty_cache
+        if key_rows != vector_rows:
+            with open(self.cache_keys_path, "r+b") as f:
+                f.truncate(rows * 32)
+            with open(self.cache_vectors_path, "r+b") as f:
+                f.truncate(rows * row_size)
+
+        keys = np.fromfile(self.cache_keys_path, dtype="S32")
+
+        vectors = np.memmap(
+            self.cache_vectors_path,
+            dtype=_CACHE_DTYPE,
+            mode="r",
+            shape=(rows, self.embeddings_dim),
+        )
+        return keys, vectors
 
-    def _save_cache(self, cache: Dict[str, List[float]]) -> None:
+    def _append_cache(self, digests: np.ndarray, embeddings: np.ndarray) -> None:
         """
-        Сохраняет кэш эмбеддингов в файл.
+        Дописывает новые эмбеддинги в конец файлов кэша.
 
         Args:
-            cache: Словарь с кэшированными эмбеддингами
+            digests: Дайджесты текстов (dtype S32)
+            embeddings: Эмбеддинги в том же порядке
         """
-        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        # Нечего дописывать - не трогаем файлы кэша
+        if len(digests) == 0:
+            return
+
+        os.makedirs(os.path.dirname(self.cache_keys_path), exist_ok=True)
 
         try:
-            with gzip.open(self.cache_path, "wt") as f:
-                json.dump(
-                    {
-                        "version": "1.1",
-                        "model": self.model,
-                        "created_at": time.time(),
-                        "embeddings": cache,
-                    },
-                    f,
-                )
+            if not os.path.exists(self.cache_meta_path):
+                with open(self.cache_meta_path, "w", encoding="utf-8") as f:
+                    json.dump(
+                        {
+                            "version": _CACHE_VERSION,
+                            "model": self.model,
+                            "dim": self.embeddings_dim,
+                            "created_at": time.time(),
+                        },
+                        f,
+                    )
+
+            # Сначала векторы: при сбое между записями лишние векторы без ключей
+            # будут отброшены при следующей загрузке
+            with open(self.cache_vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(embeddings, dtype=_CACHE_DTYPE).tobytes())
+            with open(self.cache_keys_path, "ab") as f:
+                f.write(digests.tobytes())
         except Exception as e:
             logger.error(f"Ошибка при сохранении кэша эмбеддингов: {e}")
 
     async def get_embeddings(
-        self, texts: List[str], batch_size: int = 32, max_retries: int = 5
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        max_retries: int = 5,
+        client: Optional[httpx.AsyncClient] = None,
     ) -> np.ndarray:
         """
         Получает эмбеддинги с использованием кэша.
@@ -105,30 +193,50 @@ class EmbeddingManager:
             texts: Список текстов для получения эмбеддингов
             batch_size: Размер пакета текстов для одного запроса
             max_retries: Максимальное количество попыток при ошибках
+            client: Общий HTTP клиент; если не передан, создается собственный
 
         Returns:
             Массив эмбеддингов
         """
-        # Загружаем кэш
-        cache = self._load_cache()
-
-        # Подготавливаем данные
-        final_embeddings = [None] * len(texts)
-        original_indices = {}
-
-        # Проверяем кэш
-        for i, text in enumerate(texts):
-            text_hash = hashlib.sha256(text.encode()).hexdigest()
-            if text_hash in cache:
-                final_embeddings[i] = cache[text_hash]
-                self.stats["cache_hits"] += 1
-            else:
-                if text not in original_indices:
-                    original_indices[text] = []
-                original_indices[text].append(i)
-                self.stats["cache_misses"] += 1
-
-        texts_to_fetch = list(original_indices.keys())
+        # Загружаем кэш в отдельном потоке, чтобы не блокировать цикл событий
+        cache_keys, cached_vectors = await asyncio.to_thread(self._load_cache)
+
+        # Дедуплицируем тексты до хэширования: повторяющиеся блоки страниц
+        # (шапки, подвалы) хэшируются один раз. inverse отображает каждый текст
+        # на номер уникального текста
+        text_ids = {}
+        inverse = np.fromiter(
+            (text_ids.setdefault(text, len(text_ids)) for text in texts),
+            dtype=np.intp,
+            count=len(texts),
+        )
+        unique_texts = list(text_ids)
+
+        # Хэшируем уникальные тексты одним пакетом и переиспользуем хэш при записи
+        # в кэш. hashlib использует OpenSSL, который сам задействует SHA-NI
+        unique_keys = _sha256_many(unique_texts)
+
+        # Ищем уникальные ключи в отсортированных ключах кэша
+        order = np.argsort(cache_keys)
+        sorted_keys = cache_keys[order]
+        positions = np.minimum(
+            np.searchsorted(sorted_keys, unique_keys), max(len(sorted_keys) - 1, 0)
+        )
+        found = np.zeros(len(unique_keys), dtype=bool)
+        if len(sorted_keys):
+            found = sorted_keys[positions] == unique_keys
+
+        unique_embeddings = np.empty(
+            (len(unique_keys), self.embeddings_dim), dtype=np.float32
+        )
+        unique_embeddings[found] = cached_vectors[order[positions[found]]]
+
+        missing = np.flatnonzero(~found)
+        hits = int(np.count_nonzero(found[inverse]))
+        self.stats["cache_hits"] += hits
+        self.stats["cache_misses"] += len(texts) - hits
+
+        texts_to_fetch = [unique_texts[i] for i in missing]
 
         logger.info(
             f"Найдено в кэше: {len(texts) - len(texts_to_fetch)}/{len(texts)} эмбеддингов."
@@ -137,24 +245,27 @@ class EmbeddingManager:
         # Получаем недостающие эмбеддинги
         if texts_to_fetch:
             new_embeddings = await self._fetch_embeddings(
-                texts_to_fetch, batch_size, max_retries
+                texts_to_fetch, batch_size, max_retries, client=client
+            )
+            unique_embeddings[missing] = new_embeddings
+
+            # Нулевые векторы - это заглушки для неудавшихся запросов, их не кэшируем
+            fetched = np.any(new_embeddings != 0, axis=1)
+            await asyncio.to_thread(
+                self._append_cache,
+                unique_keys[missing][fetched],
+                new_embeddings[fetched],
             )
 
-            for i, text in enumerate(texts_to_fetch):
-                embedding = new_embeddings[i].tolist()
-                text_hash = hashlib.sha256(text.encode()).hexdigest()
-                cache[text_hash] = embedding
-
-                for original_index in original_indices[text]:
-                    final_embeddings[original_index] = embedding
-
-        # Сохраняем обновленный кэш
-        self._save_cache(cache)
-
-        return np.array(final_embeddings, dtype=np.float32)
+        return unique_embeddings[inverse]
 
     async def _fetch_embeddings(
-        self, texts: List[str], batch_size: int = 32, max_retries: int = 5
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        max_retries: int = 5,
+        max_concurrency: int = 8,
+        client: Optional[httpx.AsyncClient] = None,
     ) -> np.ndarray:
         """
         Асинхронно получает эмбеддинги для списка текстов.
@@ -163,20 +274,21 @@ class EmbeddingManager:
             texts: Список текстов для получения эмбеддингов
             batch_size: Размер пакета текстов для одного запроса
             max_retries: Максимальное количество попыток при ошибках
+            max_concurrency: Максимальное количество одновременных запросов
+            client: Общий HTTP клиент; если не передан, создается собственный
 
         Returns:
             Массив эмбеддингов
         """
-        all_embeddings = []
+        all_embeddings = np.zeros((len(texts), self.embeddings_dim), dtype=np.float32)
+        semaphore = asyncio.Semaphore(max_concurrency)
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            for i in tqdm(
-                range(0, len(texts), batch_size), desc="Получение эмбеддингов"
-            ):
-                batch = texts[i : i + batch_size]
-                if not batch:
-                    continue
+        async def fetch_batch(
+            client: httpx.AsyncClient, start: int, progress: tqdm
+        ) -> None:
+            batch = texts[start : start + batch_size]
 
+            async with semaphore:
                 self.stats["api_calls"] += 1
                 self.stats["total_tokens"] += sum(len(text.split()) for text in batch)
 
@@ -189,20 +301,26 @@ class EmbeddingManager:
                                 "Content-Type": "application/json",
                             },
                             json={"input": batch, "model": self.model},
+                            timeout=_REQUEST_TIMEOUT,
                         )
                         response.raise_for_status()
                         data = response.json()
                         batch_embeddings = sorted(
                             data["data"], key=lambda e: e["index"]
                         )
-                        all_embeddings.extend(
-                            [item["embedding"] for item in batch_embeddings]
-                        )
-
-                        # Экспоненциальная задержка между пакетами для защиты от rate limits
-                        await asyncio.sleep(0.5 * (2 ** min(attempt, 3)))
+                        # Пишем результат на место пакета, чтобы сохранить порядок текстов
+                        all_embeddings[start : start + len(batch)] = [
+                            item["embedding"] for item in batch_embeddings
+                        ]
                         break
-                    except httpx.RequestError as e:
+                    except (httpx.RequestError, httpx.HTTPStatusError) as e:
+                        # Повторяем только сетевые ошибки и превышение rate limit
+                        if (
+                            isinstance(e, httpx.HTTPStatusError)
+                            and e.response.status_code != 429
+                        ):
+                            raise
+
                         wait_time = 2**attempt
                         logger.warning(
                             f"Ошибка при получении эмбеддингов: {e}. "
@@ -210,13 +328,23 @@ class EmbeddingManager:
                             f"Повтор через {wait_time} сек."
                         )
                         if attempt + 1 == max_retries:
+                            # Строки пакета остаются нулевыми
                             logger.error(
                                 f"Не удалось обработать пакет после {max_retries} попыток."
                             )
-                            all_embeddings.extend(
-                                [[0.0] * self.embeddings_dim] * len(batch)
-                            )
                         else:
                             await asyncio.sleep(wait_time)
 
-        return np.array(all_embeddings, dtype=np.float32)
+            progress.update(1)
+
+        async with contextlib.AsyncExitStack() as stack:
+            if client is None:
+                client = await stack.enter_async_context(create_http_client(60.0))
+
+            starts = range(0, len(texts), batch_size)
+            with tqdm(total=len(starts), desc="Получение эмбеддингов") as progress:
+                await asyncio.gather(
+                    *(fetch_batch(client, start, progress) for start in starts)
+                )
+
+        return all_embeddings
@@ -0,0 +1,20 @@
+import httpx
+
+
+def create_http_client(timeout: float = 30.0, **kwargs) -> httpx.AsyncClient:
+    """
+    Создает асинхронный HTTP клиент с пулом соединений и поддержкой HTTP/2.
+
+    Args:
+        timeout: Таймаут запроса в секундах
+        **kwargs: Дополнительные параметры httpx.AsyncClient
+
+    Returns:
+        Асинхронный HTTP клиент
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=httpx.Timeout(timeout, connect=10.0),
+        **kwargs,
+    )
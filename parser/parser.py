@@ -3,11 +3,13 @@ from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Tuple
 
 import hnswlib
+import httpx
 
 from .embedding_manager import EmbeddingManager
+from .http_client import create_http_client
 from logger import logger
 from .text_processor import TextProcessor
-from .vector_builder import VectorDBBuilder
+from .vector_builder import ChunkStore, VectorDBBuilder
 from .web_scrapper import WebScraper
 
 
@@ -54,6 +56,9 @@ class Parser:
             config.hnsw_index_path, config.metadata_path, config.embeddings_dim
         )
 
+        # Общий HTTP клиент для парсинга и эмбеддингов создается при первом запуске
+        self._client: Optional[httpx.AsyncClient] = None
+
         # Статистика выполнения
         self.stats = {
             "urls_processed": 0,
@@ -83,7 +88,7 @@ class Parser:
 
     async def _parse_and_create_vector_db(
         self,
-    ) -> Tuple[Optional[hnswlib.Index], List[Dict[str, str]]]:
+    ) -> Tuple[Optional[hnswlib.Index], Optional[ChunkStore]]:
         """
         Асинхронно собирает данные, затем создает и сохраняет векторную базу.
 
@@ -95,26 +100,29 @@ class Parser:
 
         # Парсинг страниц
         logger.info(f"Парсинг {len(self.config.urls_to_parse)} страниц...")
-        scraped_docs = await self.scraper.scrape_urls(self.config.urls_to_parse)
+        scraped_docs = await self.scraper.scrape_urls(
+            self.config.urls_to_parse, client=self._client
+        )
 
         self.stats["urls_processed"] = len(scraped_docs)
         self.stats["urls_failed"] = len(self.config.urls_to_parse) - len(scraped_docs)
 
         if not scraped_docs:
             logger.error("Не удалось спарсить ни одну страницу. Прерываю выполнение.")
-            return None, []
+            return None, None
 
         # Разделение текстов на чанки
         all_chunks = await self.text_processor.process_documents(scraped_docs)
-        self.stats["chunks_created"] = len(all_chunks)
+        self.stats["chunks_created"] = len(all_chunks["texts"])
 
-        if not all_chunks:
+        if not all_chunks["texts"]:
             logger.error("Не создано ни одного чанка. Прерываю выполнение.")
-            return None, []
+            return None, None
 
         # Получение эмбеддингов
-        chunk_texts = [chunk["text"] for chunk in all_chunks]
-        embeddings = await self.embedding_manager.get_embeddings(chunk_texts)
+        embeddings = await self.embedding_manager.get_embeddings(
+            all_chunks["texts"], client=self._client
+        )
 
         # Создание и сохранение индекса
         index, metadata = self.vector_db_builder.create_index(embeddings, all_chunks)
@@ -140,10 +148,21 @@ class Parser:
         Returns:
             Dict: Статистика выполнения
         """
+        if self._client is None:
+            self._client = create_http_client(
+                30.0, headers=self.config.request_headers, follow_redirects=True
+            )
+
         await self._parse_and_create_vector_db()
         return self.stats
 
-    def load_vector_db(self) -> Tuple[Optional[hnswlib.Index], List[Dict[str, str]]]:
+    async def shutdown(self) -> None:
+        """Закрывает общий HTTP клиент."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def load_vector_db(self) -> Tuple[Optional[hnswlib.Index], Optional[ChunkStore]]:
         """
         Загружает сохраненную векторную базу данных.
 
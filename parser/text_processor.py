@@ -1,26 +1,69 @@
 import asyncio
 import re
-from typing import Dict, List
+from typing import Any, Dict, List, Tuple
 
-import nltk
+import numpy as np
 
 from logger import logger
 
+_WS_RE = re.compile(r"\s+")
+# Граница предложения: знак конца предложения, пробелы и начало нового предложения
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+(?=[A-ZА-ЯЁ0-9\"«(])")
 
-class TextProcessor:
-    """Класс для обработки и разделения текста на чанки."""
 
-    def __init__(self):
-        """Инициализация TextProcessor."""
-        self._init_nltk()
+def _pack_sentences(
+    sizes: List[int], chunk_size: int, chunk_overlap: int
+) -> List[Tuple[int, int]]:
+    """
+    Группирует предложения в чанки с учетом перекрытия.
+
+    Работает только с длинами предложений, поэтому не копирует сами строки.
+
+    Args:
+        sizes: Длины предложений
+        chunk_size: Максимальный размер чанка в символах
+        chunk_overlap: Размер перекрытия между чанками в символах
+
+    Returns:
+        Список полуинтервалов (начало, конец) номеров предложений каждого чанка
+    """
+    spans = []
+    start = 0
+    current_length = 0
+
+    for i, size in enumerate(sizes):
+        # Если текущий чанк пуст или добавление предложения не превысит лимит
+        if i == start or current_length + size <= chunk_size:
+            current_length += size
+            continue
+
+        # Сохраняем текущий чанк и начинаем новый
+        spans.append((start, i))
+
+        # Идем с конца текущего чанка, добавляя предложения, пока не достигнем
+        # желаемого размера перекрытия. Накопленная длина перекрытия равна
+        # длине оставшихся предложений, поэтому сумму не нужно пересчитывать
+        overlap_start = start
+        overlap_length = 0
+        for j in range(i - 1, start - 1, -1):
+            overlap_length += sizes[j]
+            if overlap_length >= chunk_overlap:
+                overlap_start = j
+                break
 
-    def _init_nltk(self):
-        """Инициализация NLTK для токенизации предложений."""
-        try:
-            nltk.data.find("tokenizers/punkt/russian.pickle")
-        except LookupError:
-            logger.info("Загрузка пакета 'punkt' для NLTK...")
-            nltk.download("punkt")
+        # Новый чанк начинается с предложений перекрытия плюс текущее предложение
+        start = overlap_start
+        current_length = overlap_length + size
+
+    # Добавляем последний чанк, если он не пуст
+    if sizes:
+        spans.append((start, len(sizes)))
+
+    return spans
+
+
+class TextProcessor:
+    """Класс для обработки и разделения текста на чанки."""
 
     def split_text(
         self, text: str, chunk_size: int = 1000, chunk_overlap: int = 200
@@ -40,53 +83,23 @@ class TextProcessor:
             return []
 
         # Удаляем избыточные пробелы и переносы строк
-        text = re.sub(r"\s+", " ", text).strip()
+        text = _WS_RE.sub(" ", text).strip()
 
         # Разделяем текст на предложения
-        sentences = nltk.sent_tokenize(text, language="russian")
+        sentences = _SENTENCE_RE.split(text)
 
         # Объединяем предложения в чанки с учетом перекрытия
-        chunks = []
-        current_chunk = []
-        current_length = 0
-
-        for i, sentence in enumerate(sentences):
-            # Если текущий чанк пуст или добавление предложения не превысит лимит
-            if not current_chunk or current_length + len(sentence) <= chunk_size:
-                current_chunk.append(sentence)
-                current_length += len(sentence)
-            else:
-                # Сохраняем текущий чанк и начинаем новый
-                chunks.append(" ".join(current_chunk))
-
-                # Находим точку для перекрытия (backtracking)
-                overlap_end = 0
-                overlap_length = 0
-
-                # Идем с конца текущего чанка, добавляя предложения, пока не достигнем
-                # желаемого размера перекрытия
-                for j in range(len(current_chunk) - 1, -1, -1):
-                    overlap_length += len(current_chunk[j])
-                    if overlap_length >= chunk_overlap:
-                        overlap_end = j
-                        break
-
-                # Новый чанк начинается с предложений перекрытия плюс текущее предложение
-                current_chunk = current_chunk[overlap_end:] + [sentence]
-                current_length = sum(len(s) for s in current_chunk)
-
-        # Добавляем последний чанк, если он не пуст
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
-
-        return chunks
+        spans = _pack_sentences(
+            [len(sentence) for sentence in sentences], chunk_size, chunk_overlap
+        )
+        return [" ".join(sentences[start:end]) for start, end in spans]
 
     async def process_documents(
         self,
         documents: List[Dict[str, str]],
         chunk_size: int = 1000,
         chunk_overlap: int = 200,
-    ) -> List[Dict[str, str]]:
+    ) -> Dict[str, Any]:
         """
         Обрабатывает список документов и разделяет их на чанки.
 
@@ -96,25 +109,34 @@ class TextProcessor:
             chunk_overlap: Размер перекрытия между чанками
 
         Returns:
-            Список чанков с метаданными
+            Чанки в колоночном виде: {"texts": тексты чанков,
+            "source_ids": номера источников чанков, "sources": таблица источников}
         """
-        all_chunks = []
 
         async def process_single_document(doc):
-            chunks = await asyncio.to_thread(
+            return await asyncio.to_thread(
                 self.split_text, doc["page_content"], chunk_size, chunk_overlap
             )
-            return [
-                {"text": chunk_text, "source": doc["source"]} for chunk_text in chunks
-            ]
 
         # Запускаем обработку всех документов параллельно
         tasks = [process_single_document(doc) for doc in documents]
         chunks_per_doc = await asyncio.gather(*tasks)
 
+        # Источники храним один раз в таблице, а у чанков - только их номера
+        source_table = {}
+        doc_source_ids = np.array(
+            [
+                source_table.setdefault(doc["source"], len(source_table))
+                for doc in documents
+            ],
+            dtype=np.int32,
+        )
+
         # Объединяем результаты
-        for doc_chunks in chunks_per_doc:
-            all_chunks.extend(doc_chunks)
+        texts = [text for doc_chunks in chunks_per_doc for text in doc_chunks]
+        source_ids = np.repeat(
+            doc_source_ids, [len(doc_chunks) for doc_chunks in chunks_per_doc]
+        ).astype(np.int32, copy=False)
 
-        logger.info(f"Тексты разделены на {len(all_chunks)} чанков.")
-        return all_chunks
+        logger.info(f"Тексты разделены на {len(texts)} чанков.")
+        return {"texts": texts, "source_ids": source_ids, "sources": list(source_table)}
@@ -1,12 +1,68 @@
 import json
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import hnswlib
 import numpy as np
 
 from logger import logger
 
+# Векторы нормализуются при построении индекса, поэтому скалярное произведение
+# совпадает с косинусной близостью, а hnswlib не пересчитывает нормы
+INDEX_SPACE = "ip"
+METADATA_VERSION = 4
+
+
+class ChunkStore:
+    """Колоночное хранилище чанков: тексты лежат в memory-mapped файле."""
+
+    def __init__(
+        self,
+        texts_path: str,
+        offsets_path: str,
+        sources: List[str],
+        source_ids: np.ndarray,
+    ):
+        """
+        Args:
+            texts_path: Путь к файлу с текстами чанков в UTF-8 подряд
+            offsets_path: Путь к массиву смещений начала каждого текста
+            sources: Таблица источников
+            source_ids: Номера источников чанков в таблице
+        """
+        self._offsets = np.load(offsets_path)
+        self._texts = (
+            np.memmap(texts_path, dtype=np.uint8, mode="r")
+            if self._offsets[-1] > 0
+            else np.zeros(0, dtype=np.uint8)
+        )
+        self.sources = sources
+        self.source_ids = source_ids
+
+        if len(self._offsets) != len(source_ids) + 1:
+            raise ValueError("Количество текстов не совпадает с количеством источников")
+
+    def get_text(self, i: int) -> str:
+        """
+        Возвращает текст чанка.
+
+        Args:
+            i: Номер чанка
+        """
+        return self._texts[self._offsets[i] : self._offsets[i + 1]].tobytes().decode()
+
+    def get_source(self, i: int) -> str:
+        """
+        Возвращает источник чанка.
+
+        Args:
+            i: Номер чанка
+        """
+        return self.sources[self.source_ids[i]]
+
+    def __len__(self) -> int:
+        return len(self.source_ids)
+
 
 class VectorDBBuilder:
     """Класс для создания и управления векторной базой данных."""
@@ -24,29 +80,45 @@ class VectorDBBuilder:
         self.metadata_path = metadata_path
         self.embeddings_dim = embeddings_dim
 
+        # Тексты чанков хранятся отдельно от метаданных
+        base_path = os.path.splitext(metadata_path)[0]
+        self.texts_path = f"{base_path}.texts.bin"
+        self.offsets_path = f"{base_path}.offsets.npy"
+
     def create_index(
-        self, embeddings: np.ndarray, chunks: List[Dict[str, str]]
-    ) -> Tuple[hnswlib.Index, List[Dict[str, str]]]:
+        self, embeddings: np.ndarray, chunks: Dict[str, Any]
+    ) -> Tuple[hnswlib.Index, ChunkStore]:
         """
         Создает индекс HNSW из эмбеддингов и сохраняет его.
 
         Args:
             embeddings: Массив эмбеддингов
-            chunks: Список чанков с метаданными
+            chunks: Чанки в колоночном виде (texts, source_ids, sources)
 
         Returns:
             Кортеж (индекс HNSW, метаданные)
         """
-        if embeddings.shape[0] != len(chunks):
+        num_chunks = len(chunks["texts"])
+        if embeddings.shape[0] != num_chunks:
             raise ValueError(
-                f"Количество эмбеддингов ({embeddings.shape[0]}) не совпадает с количеством чанков ({len(chunks)})"
+                f"Количество эмбеддингов ({embeddings.shape[0]}) не совпадает с количеством чанков ({num_chunks})"
             )
 
+        # hnswlib копирует данные, если массив не непрерывный или не float32
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = np.ascontiguousarray(
+            embeddings / np.maximum(norms, 1e-12), dtype=np.float32
+        )
+
+        # Для небольших баз высокое качество графа достигается и при меньшем ef
+        ef_construction = 100 if num_chunks < 10_000 else 200
+
         # Создаем и наполняем индекс
         logger.info("Создание HNSWLib индекса...")
-        index = hnswlib.Index(space="cosine", dim=self.embeddings_dim)
-        index.init_index(max_elements=len(chunks), ef_construction=200, M=16)
-        index.add_items(embeddings, np.arange(len(chunks)))
+        index = hnswlib.Index(space=INDEX_SPACE, dim=self.embeddings_dim)
+        index.init_index(max_elements=num_chunks, ef_construction=ef_construction, M=16)
+        index.set_num_threads(os.cpu_count() or 4)
+        index.add_items(embeddings, np.arange(num_chunks, dtype=np.int64))
 
         # Сохраняем индекс и метаданные
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
@@ -55,12 +127,67 @@ class VectorDBBuilder:
         index.save_index(self.index_path)
 
         logger.info(f"Сохранение метаданных в файл: {self.metadata_path}")
+        self._save_chunks(chunks)
+
+        return index, self._load_chunks()
+
+    def _save_chunks(self, chunks: Dict[str, Any]) -> None:
+        """
+        Сохраняет тексты чанков бинарным файлом со смещениями, а источники - в JSON.
+
+        Args:
+            chunks: Чанки в колоночном виде (texts, source_ids, sources)
+        """
+        encoded_texts = [text.encode() for text in chunks["texts"]]
+        offsets = np.zeros(len(encoded_texts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(text) for text in encoded_texts])
+
+        with open(self.texts_path, "wb") as f:
+            f.write(b"".join(encoded_texts))
+        np.save(self.offsets_path, offsets)
+
         with open(self.metadata_path, "w", encoding="utf-8") as f:
-            json.dump(chunks, f, ensure_ascii=False, indent=2)
+            json.dump(
+                {
+                    "version": METADATA_VERSION,
+                    "space": INDEX_SPACE,
+                    "sources": chunks["sources"],
+                    "source_ids": np.asarray(chunks["source_ids"]).tolist(),
+                },
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+
+    def _load_chunks(self) -> Optional[ChunkStore]:
+        """
+        Загружает сохраненные чанки.
+
+        Returns:
+            Хранилище чанков или None, если сохранен устаревший формат
+        """
+        with open(self.metadata_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        # Индекс, построенный в другом формате, нужно пересоздать
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != METADATA_VERSION
+            or data.get("space") != INDEX_SPACE
+        ):
+            logger.warning(
+                "Формат сохраненного индекса устарел, требуется пересоздание."
+            )
+            return None
 
-        return index, chunks
+        return ChunkStore(
+            self.texts_path,
+            self.offsets_path,
+            data["sources"],
+            np.asarray(data["source_ids"], dtype=np.int32),
+        )
 
-    def load_index(self) -> Tuple[Optional[hnswlib.Index], List[Dict[str, str]]]:
+    def load_index(self) -> Tuple[Optional[hnswlib.Index], Optional[ChunkStore]]:
         """
         Загружает сохраненную векторную базу данных.
 
@@ -68,10 +195,11 @@ class VectorDBBuilder:
             Кортеж (индекс HNSW, метаданные)
         """
         try:
-            with open(self.metadata_path, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
+            metadata = self._load_chunks()
+            if metadata is None:
+                return None, None
 
-            index = hnswlib.Index(space="cosine", dim=self.embeddings_dim)
+            index = hnswlib.Index(space=INDEX_SPACE, dim=self.embeddings_dim)
             index.load_index(self.index_path, max_elements=len(metadata))
 
             logger.info(
@@ -83,4 +211,4 @@ class VectorDBBuilder:
             logger.error(
                 f"Убедитесь, что файлы '{self.index_path}' и '{self.metadata_path}' существуют."
             )
-            return None, []
+            return None, None
@@ -1,25 +1,62 @@
 import asyncio
+import contextlib
 import re
 from typing import Dict, List, Optional
 
 import httpx
-from bs4 import BeautifulSoup
+from lxml import etree, html
 from tqdm import tqdm
 
 from logger import logger
+from .http_client import create_http_client
+
+_WS_RE = re.compile(r"\s+")
+# Элементы страницы, которые не относятся к основному содержимому
+_NOISE_XPATH = ".//script | .//style | .//nav | .//footer | .//header | .//aside"
+# Кодировка, объявленная в теге meta: <meta charset="..."> или http-equiv
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.I)
+
+
+def _create_parser(charset: Optional[str], head: bytes) -> html.HTMLParser:
+    """
+    Создает HTML парсер для кодировки страницы.
+
+    Кодировка берется из заголовка Content-Type, затем из тега meta в начале
+    страницы. Если ни одна из них не указана или не поддерживается, страница
+    считается UTF-8: по умолчанию libxml2 разбирает ее как latin-1.
+
+    Args:
+        charset: Кодировка из заголовка Content-Type
+        head: Начало страницы
+
+    Returns:
+        HTML парсер lxml
+    """
+    match = _META_CHARSET_RE.search(head, 0, 1024)
+    meta_charset = match.group(1).decode("ascii") if match else None
+
+    for encoding in (charset, meta_charset):
+        if encoding:
+            try:
+                return html.HTMLParser(encoding=encoding)
+            except LookupError:
+                logger.warning(f"Неизвестная кодировка страницы: {encoding}")
+    return html.HTMLParser(encoding="utf-8")
 
 
 class WebScraper:
     """Класс для загрузки и парсинга веб-страниц."""
 
-    def __init__(self, headers: Dict[str, str]):
+    def __init__(self, headers: Dict[str, str], max_bytes: int = 5_000_000):
         """
         Инициализация WebScraper.
 
         Args:
             headers: Заголовки для HTTP запросов
+            max_bytes: Максимальный размер загружаемой страницы в байтах
         """
         self.headers = headers
+        self.max_bytes = max_bytes
 
     async def scrape_url(
         self, client: httpx.AsyncClient, url: str
@@ -35,47 +72,86 @@ class WebScraper:
             Словарь с содержимым страницы и источником, или None в случае ошибки
         """
         try:
-            response = await client.get(url)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(
-                response.content, "lxml"
-            )  # Используем lxml для скорости
-            main_content = soup.find("main") or soup.find("body")
-
-            if main_content:
-                # Удаляем ненужные элементы
-                for tag in main_content(
-                    ["script", "style", "nav", "footer", "header", "aside"]
-                ):
-                    tag.decompose()
+            # Загружаем страницу потоком и разбираем ее по мере получения данных
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+
+                parser = None
+                received = 0
+                async for chunk in response.aiter_bytes(65536):
+                    received += len(chunk)
+                    if received > self.max_bytes:
+                        logger.warning(
+                            f"Страница {url} больше {self.max_bytes} байт, пропускаю."
+                        )
+                        return None
+                    # Кодировку определяем по заголовку и началу страницы
+                    if parser is None:
+                        parser = _create_parser(response.charset_encoding, chunk)
+                    parser.feed(chunk)
+
+            # Пустая страница
+            if parser is None:
+                return None
+
+            try:
+                tree = parser.close()
+            except etree.LxmlError:
+                return None
+            if tree is None:
+                return None
+
+            matches = tree.xpath("//main") or tree.xpath("//body")
+
+            if matches:
+                main_content = matches[0]
+
+                # Удаляем ненужные элементы, сохраняя текст, идущий после них.
+                # drop_tree приклеивает этот текст к предыдущему, поэтому
+                # отделяем его пробелом
+                for tag in main_content.xpath(_NOISE_XPATH):
+                    if tag.tail:
+                        tag.tail = " " + tag.tail
+                    tag.drop_tree()
 
                 # Извлекаем текст и очищаем его
-                text = main_content.get_text(separator=" ", strip=True)
-                clean_text = re.sub(r"\s+", " ", text)
+                text = " ".join(
+                    part
+                    for part in map(str.strip, main_content.xpath(".//text()"))
+                    if part
+                )
+                clean_text = _WS_RE.sub(" ", text)
 
                 return {"page_content": clean_text, "source": url}
 
             return None
-        except httpx.RequestError as e:
+        except (httpx.RequestError, LookupError) as e:
             logger.error(f"Ошибка при парсинге URL {url}: {e}")
             return None
 
-    async def scrape_urls(self, urls: List[str]) -> List[Dict[str, str]]:
+    async def scrape_urls(
+        self, urls: List[str], client: Optional[httpx.AsyncClient] = None
+    ) -> List[Dict[str, str]]:
         """
         Асинхронно парсит список URL.
 
         Args:
             urls: Список URL для парсинга
+            client: Общий HTTP клиент; если не передан, создается собственный
 
         Returns:
             Список словарей с содержимым страниц
         """
         scraped_docs = []
 
-        async with httpx.AsyncClient(
-            headers=self.headers, timeout=30, follow_redirects=True
-        ) as client:
+        async with contextlib.AsyncExitStack() as stack:
+            if client is None:
+                client = await stack.enter_async_context(
+                    create_http_client(
+                        30.0, headers=self.headers, follow_redirects=True
+                    )
+                )
+
             tasks = [self.scrape_url(client, url) for url in urls]
 
             for future in tqdm(
@@ -1,7 +1,10 @@
+import asyncio
 import logging
 import re
+from typing import Dict, List, Tuple
 
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -10,12 +13,39 @@ from telegram.ext import (
     filters,
 )
 
+from ai.cache import SemanticCache, TTLCache
+
 logger = logging.getLogger("eora")
 
+# Ссылка на источник в ответе модели: [N]
+_CITATION_RE = re.compile(r"\[(\d+)\]")
+# Символы, которые ломают markdown-ссылку, кодируются за один проход по URL
+_URL_SAFE = str.maketrans({"(": "%28", ")": "%29", " ": "%20"})
+
+# Инструкции по цитированию. Они не меняются между запросами, поэтому передаются
+# в системный промпт, а не в контекст
+_FORMATTING_INSTRUCTIONS = """
+ВАЖНО: При ответе ОБЯЗАТЕЛЬНО соблюдай эти правила для цитирования:
+1. Когда ссылаешься на информацию из источников, указывай источник в формате [N]
+2. N должно быть номером источника из списка источников для цитирования (начиная с 1)
+3. Добавляй ссылку [N] СРАЗУ после текста, к которому она относится
+4. Цитируй каждый источник хотя бы один раз
+5. Используй все релевантные источники из предоставленного списка
+6. НЕ добавляй URL внутри текста, используй только номера в квадратных скобках
+7. НЕ добавляй отдельный список источников в конце ответа
+    """
+
 
 class TelegramBot:
     """Класс для управления Telegram-ботом."""
 
+    # Telegram ограничивает частоту редактирования сообщения, поэтому промежуточные
+    # обновления отправляются не чаще раза в интервал и только при заметном приросте.
+    # Каждое обновление передает весь текст, поэтому прирост ограничивает и общий
+    # объем отправленных данных: не больше одного обновления на _EDIT_MIN_CHARS символов
+    _EDIT_INTERVAL = 0.8
+    _EDIT_MIN_CHARS = 512
+
     def __init__(
         self,
         token: str,
@@ -38,6 +68,11 @@ class TelegramBot:
         self.ai_client = ai_client
         self.application = None
 
+        # Готовые ответы на близкие по смыслу вопросы
+        self._response_cache = SemanticCache(threshold=0.92, maxsize=1024, ttl=3600)
+        # Контекст и источники для уже встречавшегося набора результатов поиска
+        self._context_cache = TTLCache(maxsize=512, ttl=3600)
+
         # Подготавливаем обработчики команд
         self.handlers = {"start": self.start, "help": self.help_command}
 
@@ -60,13 +95,27 @@ class TelegramBot:
         user_message = update.message.text
         chat_id = update.effective_chat.id
 
-        # Отправляем уведомление о том, что бот печатает
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-
         try:
-            # Поиск релевантной информации
+            # Если на близкий по смыслу вопрос уже отвечали, отправляем готовый ответ.
+            # Эмбеддинг вопроса кэшируется в AIClient и переиспользуется при поиске
+            query_vector = await self.ai_client.get_embedding(user_message)
+            if query_vector is not None:
+                cached_response = self._response_cache.lookup(query_vector)
+                if cached_response is not None:
+                    await update.message.reply_text(
+                        cached_response,
+                        parse_mode="markdown",
+                        disable_web_page_preview=True,
+                    )
+                    return
+
+            # Поиск релевантной информации одновременно с уведомлением о том,
+            # что бот печатает
             logger.info(f"Поиск информации по запросу: {user_message}")
-            search_results = await self.search_engine.search(user_message, top_k=36)
+            _, search_results = await asyncio.gather(
+                context.bot.send_chat_action(chat_id=chat_id, action="typing"),
+                self.search_engine.search(user_message, top_k=36),
+            )
 
             if not search_results:
                 await update.message.reply_text(
@@ -75,8 +124,8 @@ class TelegramBot:
                 )
                 return
 
-            # Создание контекста для LLM
-            context_for_llm = self.context_builder.create_context(
+            # Создание контекста для LLM и списка источников
+            context_for_llm, sources, enhanced_context = await self._build_context(
                 search_results, user_message
             )
 
@@ -86,110 +135,227 @@ class TelegramBot:
                 )
                 return
 
-            # Получаем источники
-            sources = self.context_builder.extract_sources(search_results)
-
-            # Модифицируем контекст, добавляя информацию об источниках и инструкции по форматированию
-            sources_info = "\n\nИСТОЧНИКИ ДЛЯ ЦИТИРОВАНИЯ:\n"
-            for i, source in enumerate(sources, 1):
-                sources_info += f"{i}. {source['name']} - {source['url']}\n"
-
-            formatting_instructions = """
-ВАЖНО: При ответе ОБЯЗАТЕЛЬНО соблюдай эти правила для цитирования:
-1. Когда ссылаешься на информацию из источников, указывай источник в формате [N]
-2. N должно быть номером источника из списка выше (начиная с 1)
-3. Добавляй ссылку [N] СРАЗУ после текста, к которому она относится
-4. Цитируй каждый источник хотя бы один раз
-5. Используй все релевантные источники из предоставленного списка
-6. НЕ добавляй URL внутри текста, используй только номера в квадратных скобках
-7. НЕ добавляй отдельный список источников в конце ответа
-    """
-
-            # Добавляем источники и инструкции к контексту
-            enhanced_context = context_for_llm + sources_info + formatting_instructions
-
             # Отправляем сообщение о генерации ответа
             progress_message = await update.message.reply_text("...")
 
-            # Получаем ответ от LLM со стримингом
-            full_response = ""
-            message_update_counter = 0
-
-            async for response_chunk in self.ai_client.stream_completion(
-                user_message, enhanced_context
-            ):
-                full_response += response_chunk
-                message_update_counter += 1
-
-                # Обновляем сообщение каждые 50 чанков или если чанк содержит знак конца абзаца
-                if message_update_counter >= 50 or "\n" in response_chunk:
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=progress_message.message_id,
-                            text=full_response,
-                            disable_web_page_preview=True,
+            # Получаем ответ от LLM со стримингом. Части ответа копим в списке и
+            # склеиваем только для отправки, чтобы не копировать строку на каждой части
+            response_parts = []
+            response_length = 0
+            loop = asyncio.get_running_loop()
+            last_edit_time = loop.time()
+            last_edit_length = 0
+            edit_task = None
+            completed = False
+
+            try:
+                async for response_chunk in self.ai_client.stream_completion(
+                    user_message,
+                    enhanced_context,
+                    instructions=_FORMATTING_INSTRUCTIONS,
+                ):
+                    response_parts.append(response_chunk)
+                    response_length += len(response_chunk)
+
+                    # Промежуточные обновления отправляем в фоне, не задерживая
+                    # стриминг, и не запускаем новое, пока не завершилось предыдущее
+                    now = loop.time()
+                    if (
+                        now - last_edit_time >= self._EDIT_INTERVAL
+                        and response_length - last_edit_length >= self._EDIT_MIN_CHARS
+                        and (edit_task is None or edit_task.done())
+                    ):
+                        edit_task = asyncio.create_task(
+                            self._update_progress(
+                                context,
+                                chat_id,
+                                progress_message.message_id,
+                                "".join(response_parts),
+                            )
                         )
-                        message_update_counter = 0
-                    except Exception as e:
-                        logger.warning(f"Не удалось обновить сообщение: {e}")
+                        last_edit_time = now
+                        last_edit_length = response_length
+                completed = True
+            except Exception as e:
+                # Сообщение об ошибке показываем вместо ответа, но не кэшируем
+                response_parts = [f"Ошибка при запросе к LLM: {e}"]
+
+            # Незавершенное промежуточное обновление уже не нужно: его заменит
+            # финальное. Отменяем его, чтобы оно не перезаписало финальный текст
+            if edit_task is not None and not edit_task.done():
+                edit_task.cancel()
+                await asyncio.gather(edit_task, return_exceptions=True)
+
+            full_response = "".join(response_parts)
 
             # После получения полного ответа, обрабатываем ссылки
-            # Находим все упоминания [N] в тексте по порядку их появления
-            citations = re.findall(r"\[(\d+)\]", full_response)
-
-            # Получаем уникальные номера в порядке их появления в тексте
-            unique_citations = []
-            for citation in citations:
-                if citation not in unique_citations:
-                    unique_citations.append(citation)
-
-            # Создаем маппинг старых номеров на новые последовательные номера
-            citation_mapping = {old: i + 1 for i, old in enumerate(unique_citations)}
-
-            # Создаем маппинг новых номеров на URL источников
-            url_mapping = {}
-            for old_num, new_num in citation_mapping.items():
-                old_num_int = int(old_num)
-                if 1 <= old_num_int <= len(sources):
-                    url = sources[old_num_int - 1]["url"]
-                    url_mapping[new_num] = url
-
-            # Функция для замены ссылок на последовательные номера
-            def replace_citation(match):
-                old_num = match.group(1)
-                if old_num in citation_mapping:
-                    new_num = citation_mapping[old_num]
-                    if new_num in url_mapping:
-                        return f"\[[{new_num}]({url_mapping[new_num]})]"
-                    else:
-                        return f"[{new_num}]"
-                return match.group(0)
-
-            # Заменяем все ссылки [N] на последовательные номера с URL
-            processed_response = re.sub(r"\[(\d+)\]", replace_citation, full_response)
-
-            # Отправляем финальное сообщение с обработанными ссылками
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=progress_message.message_id,
-                text=processed_response,
-                parse_mode="markdown",
-                disable_web_page_preview=True,
-            )
+            processed_response = self._process_citations(full_response, sources)
+
+            # Отправляем финальное сообщение с обработанными ссылками. Отмененное
+            # промежуточное обновление могло уже дойти до Telegram с тем же текстом -
+            # тогда сообщение уже содержит финальный ответ
+            try:
+                await context.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=progress_message.message_id,
+                    text=processed_response,
+                    parse_mode="markdown",
+                    disable_web_page_preview=True,
+                )
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+
+            # В кэш попадает только полностью полученный непустой ответ
+            if query_vector is not None and completed and full_response.strip():
+                self._response_cache.put(query_vector, processed_response)
 
         except Exception as e:
-            logger.error(f"Произошла ошибка при обработке сообщения: {e}")
+            logger.error(
+                "Произошла ошибка при обработке сообщения: %s", e, exc_info=True
+            )
             await update.message.reply_text(
                 f"❌ Произошла ошибка при обработке вашего запроса: {str(e)}\n\n"
                 "Пожалуйста, попробуйте еще раз позже или обратитесь к администратору."
             )
 
+    async def _build_context(
+        self, search_results: List[Dict], user_message: str
+    ) -> Tuple[str, List[Dict], str]:
+        """
+        Создает контекст для LLM и список источников с кэшированием.
+
+        Args:
+            search_results: Результаты поиска
+            user_message: Вопрос пользователя
+
+        Returns:
+            Кортеж (контекст, источники, контекст со списком источников для LLM)
+        """
+        # Контекст зависит от состава результатов и их релевантности
+        cache_key = tuple((r["id"], r["similarity"]) for r in search_results)
+        cached = self._context_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Сборка контекста занимает цикл событий, поэтому для большого числа
+        # результатов выполняется в отдельном потоке. Для малого числа переход
+        # в поток обходится дороже самой работы
+        if len(search_results) > 4:
+            result = await asyncio.to_thread(
+                self._render_context, search_results, user_message
+            )
+        else:
+            result = self._render_context(search_results, user_message)
+
+        self._context_cache[cache_key] = result
+        return result
+
+    def _render_context(
+        self, search_results: List[Dict], user_message: str
+    ) -> Tuple[str, List[Dict], str]:
+        """
+        Создает контекст для LLM и список источников.
+
+        Args:
+            search_results: Результаты поиска
+            user_message: Вопрос пользователя
+
+        Returns:
+            Кортеж (контекст, источники, контекст со списком источников для LLM)
+        """
+        context_for_llm = self.context_builder.create_context(
+            search_results, user_message
+        )
+        # Сортируем источники по URL, чтобы один и тот же набор источников всегда
+        # давал одинаковый текст промпта независимо от порядка результатов
+        sources = sorted(
+            self.context_builder.extract_sources(search_results),
+            key=lambda source: source["url"],
+        )
+
+        # Информация об источниках, добавляемая к контексту
+        sources_info = "ИСТОЧНИКИ ДЛЯ ЦИТИРОВАНИЯ:\n" + "".join(
+            [
+                f"{i}. {source['name']} - {source['url']}\n"
+                for i, source in enumerate(sources, 1)
+            ]
+        )
+
+        # Добавляем источники к контексту. Все, что меняется от запроса к запросу,
+        # должно идти после неизменной части промпта
+        enhanced_context = sources_info + "\n" + context_for_llm
+
+        return context_for_llm, sources, enhanced_context
+
+    def _process_citations(self, full_response: str, sources: List[Dict]) -> str:
+        """
+        Перенумеровывает ссылки [N] по порядку появления и добавляет к ним URL.
+
+        Args:
+            full_response: Ответ модели
+            sources: Источники, перечисленные в промпте
+
+        Returns:
+            Ответ с обработанными ссылками
+        """
+        # Находим все упоминания [N] в тексте по порядку их появления
+        citations = _CITATION_RE.findall(full_response)
+
+        # Без ссылок обрабатывать нечего
+        if not citations:
+            return full_response
+
+        # Получаем уникальные номера в порядке их появления в тексте
+        unique_citations = list(dict.fromkeys(citations))
+
+        # Заранее готовим замену для каждого номера: новый последовательный
+        # номер и, если источник существует, ссылку на него
+        replacements = {}
+        for new_num, old_num in enumerate(unique_citations, 1):
+            old_num_int = int(old_num)
+            if 1 <= old_num_int <= len(sources):
+                url = sources[old_num_int - 1]["url"].translate(_URL_SAFE)
+                replacements[old_num] = f"\\[[{new_num}]({url})]"
+            else:
+                replacements[old_num] = f"[{new_num}]"
+
+        # Заменяем все ссылки [N] за один проход по ответу
+        return _CITATION_RE.sub(
+            lambda match: replacements[match.group(1)], full_response
+        )
+
+    async def _update_progress(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        chat_id: int,
+        message_id: int,
+        text: str,
+    ) -> None:
+        """
+        Обновляет сообщение с промежуточным ответом.
+
+        Args:
+            context: Контекст обработчика
+            chat_id: Идентификатор чата
+            message_id: Идентификатор обновляемого сообщения
+            text: Текст ответа
+        """
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                disable_web_page_preview=True,
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение: {e}")
+
     async def error_handler(
         self, update: Update, context: ContextTypes.DEFAULT_TYPE
     ) -> None:
         """Обрабатывает ошибки в боте."""
-        logger.error(f"Ошибка при обработке обновления {update}: {context.error}")
+        logger.error("Ошибка при обработке обновления %r: %s", update, context.error)
 
         try:
             # Отправляем сообщение об ошибке пользователю
@@ -204,7 +370,17 @@ class TelegramBot:
     async def setup(self):
         """Настраивает и запускает бота."""
         # Создаем и настраиваем бота
-        self.application = Application.builder().token(self.token).build()
+        # Ответ на одно сообщение - это несколько запросов к API подряд, поэтому
+        # они идут по HTTP/2 через общие соединения и ждут свободного соединения
+        # из пула дольше стандартной секунды
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .http_version("2")
+            .pool_timeout(5.0)
+            .get_updates_http_version("2")
+            .build()
+        )
 
         # Регистрируем обработчики команд
         for command, handler in self.handlers.items():